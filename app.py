@@ -1,212 +1,685 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import math
+import queue
+import re
+import threading
+import time
+
+import openai
+import orjson
 import streamlit as st
-from openai import OpenAI
 
-# Create the OpenAI client
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+from llm_client import (
+    DISK_CACHE_EXPIRE,
+    LLM_CONCURRENCY,
+    MAX_TOKENS,
+    MODEL,
+    embed_texts,
+    get_disk_cache,
+    prompt_model,
+    run_async,
+)
+
+logger = logging.getLogger(__name__)
+
+# How many items each food list keeps. Output tokens dominate latency,
+# so keep this small.
+N_ITEMS = 5
+
+# Activities offered in the picker (users may also type their own),
+# and every position of the hours-until-activity slider
+ACTIVITIES = ["basketball", "weightlifting", "pilates", "running", "swimming", "yoga"]
+TIME_OPTIONS = [step / 4 for step in range(13)]  # 0.0 to 3.0 hours
+
+# Semantic cache: activities whose embeddings are at least this similar
+# share cached recommendations (within the same time bucket)
+SIMILARITY_THRESHOLD = 0.92
+
+# Users can type any activity, so every cache keyed on it is bounded:
+# semantic entries per time bucket (oldest evicted first), cached
+# embeddings, and cached lookups
+SEMANTIC_CACHE_SIZE = 64
+EMBEDDING_CACHE_SIZE = 256
+LOOKUP_CACHE_SIZE = 512
+
+# Fill the disk cache for every (activity, time) pair on first boot.
+# scripts/warm_cache.py does the same offline through the Batch API at
+# half the cost; set this to False when using it.
+WARM_CACHE_ON_STARTUP = True
+# The warm-up shares the process-wide API limit with live users; it takes
+# at most half of it, so their calls never queue behind all 78 warm-ups
+WARM_CONCURRENCY = max(1, LLM_CONCURRENCY // 2)
 
-def prompt_model(messages):
+
+# -----------------------
+# JSON helpers
+# -----------------------
+LIST_SECTIONS = ("best_foods", "ok_foods", "foods_to_avoid")
+
+# A bullet or list number the model sometimes leaves at the start of an
+# item ("- Banana", "2) Banana"). Whitespace after it is required, so
+# "7-Eleven taquito" or "1.5 cups" are left alone.
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+
+def clean_item(item):
     """
-    Helper function to send a list of messages to the chat.completions API
-    and return the model's response text.
+    Strip a leading bullet/number marker from one list item.
     """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",  # or "gpt-4o" as needed
-        messages=messages,
-        temperature=0.7
-    )
-    return response.choices[0].message.content.strip()
+    return _BULLET_RE.sub("", item, count=1)
 
 
-# -----------------------
-# STEP 1: Get Macro Info
-# -----------------------
-def step_one_get_macros(activity, time_until):
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _extract_json(reply_text):
+    """
+    Recover the JSON object from a reply wrapped in ```json fences or
+    prose: decode from each "{" in turn (prose may hold braces of its own,
+    e.g. "{activity}") and return the first complete object.
+    Raises ValueError if there is none.
+    """
+    start = reply_text.find("{")
+    while start != -1:
+        try:
+            return _JSON_DECODER.raw_decode(reply_text, start)[0]
+        except json.JSONDecodeError:
+            start = reply_text.find("{", start + 1)
+    raise ValueError("The model's reply has no complete JSON object (it may have been cut off).")
+
+
+def parse_recommendation(reply_text):
     """
-    1) Ask the model to recommend a macronutrient ratio (carbs, protein, fats)
-       for a 17-year-old's pre-activity meal/snack, given the activity and time.
-    2) Return only a short explanation in plain text (no disclaimers).
+    Parse a finished structured reply into the recommendations dict,
+    keeping at most N_ITEMS per list (the model sometimes returns more
+    than asked for). Raises ValueError if the reply is not complete JSON
+    (e.g. it hit MAX_TOKENS) or does not match RECOMMENDATION_FORMAT, so a
+    broken answer is never cached.
     """
-    user_content = f"""
-    You are a sports nutrition expert. 
-    The athlete is 17, has only convenience stores or fast-food places available 
-    (7-Eleven, McDonald’s, Chipotle), 
-    and the upcoming activity is {activity} in {time_until} hours.
+    # Fast path: a clean reply ends with "}" and parses as is (only strip
+    # a copy in the rare case of trailing whitespace). Anything else, such
+    # as fenced or chatty output, goes through the slower extraction.
+    data = None
+    if reply_text.endswith("}") or reply_text.rstrip().endswith("}"):
+        try:
+            data = orjson.loads(reply_text)
+        except orjson.JSONDecodeError:
+            pass
+    if data is None:
+        data = _extract_json(reply_text)
+
+    # The API enforces the schema, but a server without structured outputs
+    # (see LLM_BASE_URL) may not, so check the shape before trusting it
+    if not isinstance(data, dict) or not isinstance(data.get("macro_explanation"), str):
+        raise ValueError("The model's reply has no macro explanation.")
+    recommendations = {"macro_explanation": data["macro_explanation"]}
+    for section in LIST_SECTIONS:
+        items = data.get(section)
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            raise ValueError(f"The model's reply has no valid {section!r} list.")
+        recommendations[section] = [clean_item(item) for item in items[:N_ITEMS]]
+    return recommendations
+
+
+def format_bullets(items):
+    """
+    Turn a list of items into a Markdown bullet list.
+    """
+    return "\n".join(f"- {item}" for item in items)
+
 
-    What macronutrient ratio (carbs/protein/fats) do you recommend, and why?
-    Return a short explanation in plain text, no disclaimers.
+class IncrementalJsonParser:
+    """
+    Parse a JSON document as it streams in, one chunk at a time.
+    feed() returns (path, value) pairs for each leaf value (string, number,
+    true/false/null) completed by that chunk, e.g. (("items", 0), "Banana").
+    Each character is scanned once, instead of re-parsing the whole
+    accumulated text on every chunk. Only an object starts the document:
+    text before its opening brace or after its closing one (prose, code
+    fences, a bracketed "[3]") is ignored, and so is a brace group that
+    closes without yielding a value (a "{activity}" in prose), after
+    which the search for the object starts again.
     """
 
-    messages = [
-        {"role": "developer", "content": "You are a concise, helpful nutrition coach."},
-        {"role": "user", "content": user_content}
-    ]
-    return prompt_model(messages)
+    def __init__(self):
+        self._stack = []      # one [is_array, key or index, expecting_key] frame per open container
+        self._token = []      # characters of the string/scalar being read
+        self._in_string = False
+        self._escape = False
+        self._in_scalar = False
+        self._finished = False
+        self._emitted = False   # whether the open top-level object yielded a value
+
+    def _path(self):
+        return tuple(frame[1] for frame in self._stack)
+
+    def _emit(self, raw, events):
+        try:
+            value = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return
+        frame = self._stack[-1]
+        if frame[2]:
+            # A string in key position names the next value
+            frame[1], frame[2] = value, False
+        else:
+            events.append((self._path(), value))
+            self._emitted = True
+
+    def pending_string(self):
+        """
+        Return (path, text so far) for a string value that is still
+        streaming in, or None if no string value is open.
+        """
+        if not self._in_string or self._stack[-1][2]:
+            return None
+        raw = "".join(self._token)
+        # Close the string, dropping an escape sequence cut off mid-way
+        for candidate in (raw, raw[:raw.rfind("\\")]):
+            try:
+                return self._path(), orjson.loads(candidate + '"')
+            except orjson.JSONDecodeError:
+                continue
+        return None
+
+    def feed(self, chunk):
+        events = []
+        for ch in chunk:
+            if self._finished:
+                break
+            if self._in_string:
+                self._token.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._emit("".join(self._token), events)
+                continue
+            if self._in_scalar:
+                if ch not in ",}] \t\r\n":
+                    self._token.append(ch)
+                    continue
+                self._in_scalar = False
+                self._emit("".join(self._token), events)
+            if not self._stack:
+                if ch == "{":
+                    self._stack.append([False, None, True])
+                    self._emitted = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._token = [ch]
+            elif ch in "{[":
+                self._stack.append([True, 0, False] if ch == "[" else [False, None, True])
+            elif ch in "}]":
+                self._stack.pop()
+                # A top-level group with no values was prose; keep looking
+                self._finished = not self._stack and self._emitted
+            elif ch == ",":
+                frame = self._stack[-1]
+                if frame[0]:
+                    frame[1] += 1
+                else:
+                    frame[2] = True
+            elif ch != ":" and not ch.isspace():
+                self._in_scalar = True
+                self._token = [ch]
+        return events
 
 
 # --------------------------------------------------
-# STEP 2A & 2B: Generate & Filter "Best" Foods
+# Recommendations: one structured call
 # --------------------------------------------------
-def generate_best_candidates(macro_summary):
+RECOMMENDATION_PROMPT = """
+You are a sports nutrition expert.
+The athlete is 17, has only convenience stores or fast-food places available
+(7-Eleven, McDonald’s, Chipotle),
+and the upcoming activity is {activity} in {time_until} hours.
+
+Return JSON with:
+- "macro_explanation": the macronutrient ratio (carbs/protein/fats) you recommend, and why,
+  as a short plain-text explanation with no disclaimers.
+- "best_foods": the {n_items} food/drink items that most closely match that ratio
+  and that a 17-year-old would definitely choose to eat.
+- "ok_foods": {n_items} items a 17-year-old would choose that are still fairly healthy,
+  but not as ideal as the "best_foods".
+- "foods_to_avoid": {n_items} items a 17-year-old is very likely to choose
+  that conflict with the recommended macros.
+Every item must be available from a convenience store or fast-food restaurant,
+with approximate carbs/fats/protein percentages in parentheses,
+e.g. "Banana (Carbs: 90%, Fats: 5%, Protein: 5%)".
+"""
+
+# Built once; every request shares the same system message
+_SYS_NUTRITION = {"role": "developer", "content": "You are a concise, helpful nutrition coach."}
+
+# 0 keeps replies deterministic, so one cached answer per key is enough
+RECOMMENDATION_TEMPERATURE = 0.0
+
+_FOOD_LIST_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+# Strict JSON schema for the reply; properties are generated in this order,
+# so the macro explanation streams in first
+RECOMMENDATION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "recommendation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "macro_explanation": {"type": "string"},
+                "best_foods": _FOOD_LIST_SCHEMA,
+                "ok_foods": _FOOD_LIST_SCHEMA,
+                "foods_to_avoid": _FOOD_LIST_SCHEMA,
+            },
+            "required": ["macro_explanation", *LIST_SECTIONS],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def recommendation_messages(activity, time_until):
     """
-    Prompt the model to create 20 candidate 'Best' items
-    (bullet list, each with approximate macros).
+    Build the chat messages for one (activity, time_until) pair.
     """
-    user_content = f"""
-    We have the following recommended macronutrient ratio: 
-    {macro_summary}
+    return [
+        _SYS_NUTRITION,
+        {"role": "user", "content": RECOMMENDATION_PROMPT.format(
+            activity=activity,
+            time_until=time_until,
+            n_items=N_ITEMS,
+        )}
+    ]
+
 
-    Step: Create a bullet list of 20 potential 'Best' food/drink items 
-    for a 17-year-old (convenience stores / fast-food).
-    - Each item should include approximate carbs/fats/protein percentages 
-      in parentheses, e.g. (Carbs: 50%, Fats: 20%, Protein: 30%).
-    - No disclaimers.
-    - Return only the bulleted list, 20 items total.
+async def fetch_recommendations(activity, time_until, on_delta=None):
+    """
+    Ask for the macro ratio and the Best/OK/Avoid lists in a single call
+    that must follow RECOMMENDATION_FORMAT, and return them as a plain dict.
+    If on_delta is given, the JSON reply is streamed to on_delta(text).
     """
+    messages = recommendation_messages(activity, time_until)
+    reply = await prompt_model(
+        messages,
+        on_delta,
+        response_format=RECOMMENDATION_FORMAT,
+        temperature=RECOMMENDATION_TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+    )
+    return parse_recommendation(reply)
 
-    messages = [
-        {"role": "developer", "content": "Generate 20 bullet-list items."},
-        {"role": "user", "content": user_content}
-    ]
-    return prompt_model(messages)
+
+# --------------------------------------------------
+# Disk cache
+# --------------------------------------------------
+# Changing the prompt, schema, list size or sampling settings changes this,
+# so stale answers are not reused
+PROMPT_FINGERPRINT = hashlib.sha256(orjson.dumps([
+    _SYS_NUTRITION,
+    RECOMMENDATION_PROMPT,
+    RECOMMENDATION_FORMAT,
+    N_ITEMS,
+    MAX_TOKENS,
+    RECOMMENDATION_TEMPERATURE,
+])).hexdigest()
+
+
+def disk_cache_key(activity, time_until):
+    """
+    Key a recommendation on its inputs, the model, and the prompt set.
+    """
+    payload = orjson.dumps([activity, time_until, MODEL, PROMPT_FINGERPRINT])
+    return hashlib.sha256(payload).hexdigest()
 
 
-def filter_best_candidates(macro_summary, candidate_text):
+def store_recommendations(activity, time_until, recommendations, embedding=None):
     """
-    Prompt the model to:
-    - Qualitatively check how each of the 20 items aligns with the macro ratio in macro_summary.
-    - Keep only the 10 best matches.
-    - Return them as a bulleted list of 10 items.
+    Write one result to the disk cache and, if the activity's embedding is
+    given, to the semantic cache. Never waits on the event loop, so it is
+    safe to call from the loop thread.
     """
-    user_content = f"""
-    We have these 20 'Best' candidate items (with approximate macros):
-    {candidate_text}
+    get_disk_cache().set(
+        disk_cache_key(activity, time_until),
+        recommendations,
+        expire=DISK_CACHE_EXPIRE,
+    )
+    if embedding is not None:
+        get_semantic_cache().store(embedding, time_bucket(time_until), recommendations)
+
+
+async def fetch_and_store(activity, time_until, embedding=None, on_delta=None):
+    """
+    Fetch one (activity, time) pair and store it as soon as it arrives, on
+    the event loop. A reply that finishes after the script was stopped
+    (the user clicked or moved the slider mid-stream) is still kept.
+    """
+    recommendations = await fetch_recommendations(activity, time_until, on_delta)
+    store_recommendations(activity, time_until, recommendations, embedding)
+    return recommendations
 
-    Our recommended macronutrient ratio is:
-    {macro_summary}
 
-    Now:
-    1) Evaluate each item qualitatively for how closely it matches the recommended macros.
-    2) Select the closest matches to the recommended macros. 
-    3) Prioritize the items that a 17 year old would definitely choose to eat AND is available from a convenience store or fast food restaurant.
-    4) Return them as a bullet list of up to 5 items, no extra commentary.
+async def warm_one(activity, time_until, semaphore):
     """
+    Compute and store one (activity, time) pair unless it is already cached.
+    """
+    if disk_cache_key(activity, time_until) in get_disk_cache():
+        return
+    async with semaphore:
+        await fetch_and_store(activity, time_until)
+
 
-    messages = [
-        {"role": "developer", "content": "Filter to 10 items that best match macros."},
-        {"role": "user", "content": user_content}
+async def warm_all():
+    """
+    Warm every picker activity at every slider position, at most
+    WARM_CONCURRENCY pipelines at a time. One failure doesn't stop the rest.
+    Custom activities close to a picker activity reach these results too,
+    through lookup_known_activity().
+    """
+    semaphore = asyncio.Semaphore(WARM_CONCURRENCY)
+    pairs = [(activity, time_until) for activity in ACTIVITIES for time_until in TIME_OPTIONS]
+    results = await asyncio.gather(
+        *(warm_one(activity, time_until, semaphore) for activity, time_until in pairs),
+        return_exceptions=True,
+    )
+    failed = [
+        (pair, result) for pair, result in zip(pairs, results)
+        if isinstance(result, Exception)
     ]
-    return prompt_model(messages)
+    if failed:
+        logger.warning(
+            "Cache warm-up failed for %d of %d pairs: %s (first error: %r)",
+            len(failed),
+            len(pairs),
+            ", ".join(f"{activity} at {time_until}h" for (activity, time_until), _ in failed),
+            failed[0][1],
+        )
+
+
+@st.cache_resource
+def warm_cache():
+    """
+    Start warming the disk cache in the background, once per server
+    process. Returns the future so callers can check on it; an error
+    that stops the whole warm-up is logged when it happens.
+    """
+    future = run_async(warm_all())
+    future.add_done_callback(log_warm_up_failure)
+    return future
+
+
+def log_warm_up_failure(future):
+    """
+    Log the error that stopped the cache warm-up, if any.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Cache warm-up stopped", exc_info=future.exception())
 
 
 # --------------------------------------------------
-# STEP 3A & 3B: Generate & Filter "OK" Foods
+# Semantic cache
 # --------------------------------------------------
-def generate_ok_candidates(macro_summary):
+@st.cache_resource
+def get_activity_embeddings():
     """
-    Prompt the model to create 20 candidate 'OK' items (bullet list).
+    Embed the known activities once, in a single request, so picking one of
+    them never costs an extra embeddings call.
     """
-    user_content = f"""
-    We have the following recommended macronutrient ratio:
-    {macro_summary}
+    vectors = run_async(embed_texts(ACTIVITIES)).result()
+    return dict(zip(ACTIVITIES, vectors))
 
-    Step: Create a bullet list of 20 'OK' food/drink items 
-    for a 17-year-old (convenience stores / fast-food).
-    - These items should be acceptable, but not as ideal as the 'Best' items.
-    - Include approximate carbs/fats/protein percentages in parentheses.
-    - Return only the bulleted list, 20 items total, no disclaimers.
-    """
 
-    messages = [
-        {"role": "developer", "content": "Generate 20 'OK' bullet-list items."},
-        {"role": "user", "content": user_content}
-    ]
-    return prompt_model(messages)
+@st.cache_data(max_entries=EMBEDDING_CACHE_SIZE, show_spinner=False)
+def embed_activity(activity):
+    """
+    Return the embedding for an activity, using the precomputed vectors
+    when possible. Cached, so a miss that is looked up and then stored
+    embeds a typed-in activity only once.
+    """
+    known = get_activity_embeddings()
+    if activity in known:
+        return known[activity]
+    return run_async(embed_texts([activity])).result()[0]
 
 
-def filter_ok_candidates(macro_summary, candidate_text, best_list_text):
+def semantic_embedding(activity):
     """
-    Prompt the model to:
-    - Check that these items are not as good as the 'Best' items, but still somewhat healthy.
-    - Keep the 10 healthiest among them.
-    - Return as a bullet list of 10 items.
+    Embed an activity for the semantic cache, or return None if the
+    embeddings call fails. The semantic cache only saves calls, so its
+    failures must not fail a request the chat model could still answer.
     """
-    user_content = f"""
-    We have these 20 'OK' candidate items:
-    {candidate_text}
+    try:
+        return embed_activity(activity)
+    except openai.OpenAIError:
+        logger.warning("Embedding %r failed; skipping the semantic cache", activity, exc_info=True)
+        return None
 
-    Our recommended macronutrient ratio is:
-    {macro_summary}
 
-    The 'Best' list is:
-    {best_list_text}
-
-    Now:
-    1) Evaluate each 'OK' item. Confirm it's not as ideal as the 'Best' list items.
-    2) Choose the healthiest from this 'OK' pool that a 17 year old would choose to eat AND is available from a convenience store or fast food restaurant.
-    3) Return them as a bullet list of 5 items or fewer, no extra commentary.
+def similarity(a, b):
     """
-
-    messages = [
-        {"role": "developer", "content": "Filter to 10 items that are healthy but not as good as 'Best'."},
-        {"role": "user", "content": user_content}
-    ]
-    return prompt_model(messages)
+    Cosine similarity of two embeddings. OpenAI embeddings are unit
+    length, so this is just their dot product.
+    """
+    return sum(x * y for x, y in zip(a, b))
 
 
-# --------------------------------------------------
-# STEP 4A & 4B: Generate & Filter "Avoid" Foods
-# --------------------------------------------------
-def generate_avoid_candidates(macro_summary):
+def lookup_known_activity(embedding, time_until):
     """
-    Prompt the model to create 20 candidate 'Avoid' items (bullet list).
+    Return the disk-cached recommendations of the picker activity most
+    similar to embedding, from the same time bucket (the exact time
+    first), if it clears SIMILARITY_THRESHOLD. Read straight from the
+    disk cache, so entries count however they got there: the startup
+    warm-up, scripts/warm_cache.py, or earlier requests.
     """
-    user_content = f"""
-    We have the following recommended macronutrient ratio:
-    {macro_summary}
+    bucket = time_bucket(time_until)
+    times = sorted(
+        (option for option in TIME_OPTIONS if time_bucket(option) == bucket),
+        key=lambda option: abs(option - time_until),
+    )
+    ranked = sorted(
+        ((similarity(vector, embedding), activity)
+         for activity, vector in get_activity_embeddings().items()),
+        reverse=True,
+    )
+    for score, activity in ranked:
+        if score < SIMILARITY_THRESHOLD:
+            break
+        for option in times:
+            cached = get_disk_cache().get(disk_cache_key(activity, option))
+            if cached is not None:
+                return cached
+    return None
 
-    Step: Create a bullet list of 20 'Avoid' food/drink items 
-    for a 17-year-old with access to convenience stores or fast-food places.
-    - These are not ideal for the upcoming activity.
-    - Must include approximate carbs/fats/protein in parentheses.
-    - Focus on items that are very commonly chosen by a 17-year-old 
-      but conflict with the recommended macros.
-    - Return only the bulleted list, 20 items total, no disclaimers.
+
+class SemanticCache:
+    """
+    In-process store of (activity embedding, recommendations) pairs, kept
+    per time bucket. lookup() returns the recommendations of the most
+    similar stored activity in the same time bucket, if it clears
+    SIMILARITY_THRESHOLD. Picker activities are not stored here; they are
+    read from the disk cache by lookup_known_activity().
+    Each bucket keeps at most max_entries pairs, dropping the oldest, so
+    memory and lookup time stay bounded however many activities are typed.
     """
 
-    messages = [
-        {"role": "developer", "content": "Generate 20 'Avoid' bullet-list items."},
-        {"role": "user", "content": user_content}
-    ]
-    return prompt_model(messages)
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding, time_bucket):
+        with self._lock:
+            entries = list(self._buckets.get(time_bucket, ()))
+        best, best_similarity = None, self.threshold
+        for stored_embedding, data in entries:
+            score = similarity(stored_embedding, embedding)
+            if score >= best_similarity:
+                best, best_similarity = data, score
+        return best
+
+    def store(self, embedding, time_bucket, data):
+        with self._lock:
+            entries = self._buckets.get(time_bucket)
+            if entries is None:
+                entries = self._buckets[time_bucket] = collections.deque(maxlen=self.max_entries)
+            entries.append((embedding, data))
+
+    def discard(self, embedding, time_bucket):
+        """
+        Remove every entry lookup(embedding, time_bucket) could return.
+        """
+        with self._lock:
+            entries = self._buckets.get(time_bucket)
+            if entries is None:
+                return
+            self._buckets[time_bucket] = collections.deque(
+                (entry for entry in entries if similarity(entry[0], embedding) < self.threshold),
+                maxlen=self.max_entries,
+            )
+
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache():
+    """
+    One semantic cache per server process, shared by every session.
+    """
+    return SemanticCache()
 
 
-def filter_avoid_candidates(macro_summary, candidate_text):
+def normalize_inputs(activity, time_until):
     """
-    Prompt the model to:
-    - Confirm these items are very common for a 17-year-old, 
-      but are not ideal given the recommended macros.
-    - Select 10 that are the most likely to be chosen (yet poor choices).
-    - Return them as a bullet list of 10 items, no extra commentary.
+    Collapse equivalent inputs ("Basketball " vs "basketball", 1.0 vs
+    1.0000001) to one cache key: trimmed lowercase activity, and hours
+    rounded to the slider's quarter-hour step.
     """
-    user_content = f"""
-    We have these 20 'Avoid' candidate items:
-    {candidate_text}
+    return activity.strip().lower(), round(time_until * 4) / 4
 
-    Our recommended macronutrient ratio is:
-    {macro_summary}
 
-    Now:
-    1) Evaluate each item as a poor choice for this scenario.
-    2) Which 10 are most likely to be chosen by a 17-year-old 
-       but still conflict with the recommended macros?
-    3) Return them as a bullet list of 5 items, no extra commentary.
+def time_bucket(time_until):
     """
+    Floor hours-until-activity to the half hour for semantic lookups, so
+    neighbouring slider steps (1.0/1.25, 1.5/1.75, ...) always share a bucket.
+    round() would send ties to the even half hour and pair steps unevenly.
+    """
+    return math.floor(time_until * 2) / 2
 
-    messages = [
-        {"role": "developer", "content": "Select 10 'Avoid' items that are most tempting yet poor."},
-        {"role": "user", "content": user_content}
-    ]
-    return prompt_model(messages)
+
+# --------------------------------------------------
+# Full pipeline (cached lookups, streamed misses)
+# --------------------------------------------------
+SECTION_TITLES = {
+    "macro_explanation": "Recommended Macronutrient Ratio",
+    "best_foods": f"Best Foods ({N_ITEMS})",
+    "ok_foods": f"OK Foods ({N_ITEMS})",
+    "foods_to_avoid": f"Foods to Avoid ({N_ITEMS})",
+}
+
+
+def format_recommendations(recommendations):
+    """
+    Build one Markdown document for every section present, so the whole
+    page goes to the browser as a single message.
+    """
+    blocks = []
+    for section, title in SECTION_TITLES.items():
+        if section not in recommendations:
+            continue
+        body = recommendations[section]
+        if section != "macro_explanation":
+            body = format_bullets(body)
+        blocks.append(f"### {title}\n\n{body}")
+    return "\n\n".join(blocks)
+
+
+def show_live_preview(future, updates):
+    """
+    Render the streamed JSON reply from the updates queue until the future
+    finishes, showing each field and list item as soon as it is complete.
+    The preview is cleared at the end, since main() renders the finished
+    results.
+    """
+    preview = st.empty()
+    parser = IncrementalJsonParser()
+    partial = {}
+
+    done = False
+    while not done:
+        # Check before draining, so pieces queued just before the end are not lost
+        done = future.done()
+        changed = False
+        while True:
+            try:
+                delta = updates.get_nowait()
+            except queue.Empty:
+                break
+            for path, value in parser.feed(delta):
+                section = path[0] if path else None
+                if path == ("macro_explanation",):
+                    partial[section] = value
+                    changed = True
+                elif (section in LIST_SECTIONS and len(path) == 2
+                        and isinstance(path[1], int) and path[1] < N_ITEMS):
+                    partial.setdefault(section, []).append(clean_item(value))
+                    changed = True
+        # Show the macro explanation word by word, not only once it is complete
+        pending = parser.pending_string()
+        if pending is not None and pending[0] == ("macro_explanation",):
+            partial["macro_explanation"] = pending[1]
+            changed = True
+        if changed:
+            preview.markdown(format_recommendations(partial))
+        if not done:
+            time.sleep(0.1)
+
+    preview.empty()
+
+
+@st.cache_data(ttl=86400, max_entries=LOOKUP_CACHE_SIZE, show_spinner=False)
+def lookup_recommendations(activity, time_until):
+    """
+    Return the cached recommendations for one (activity, time_until) pair
+    as a plain dict, or None if nothing is cached yet. Checks the disk
+    cache, then near-identical activities: typed ones in the semantic
+    cache, picker ones in the disk cache.
+    Nothing is drawn here, since Streamlit replays the page elements of a
+    cached function on every hit; main() streams misses instead.
+    """
+    cached = get_disk_cache().get(disk_cache_key(activity, time_until))
+    if cached is not None:
+        return cached
+    embedding = semantic_embedding(activity)
+    if embedding is None:
+        return None
+    cached = get_semantic_cache().lookup(embedding, time_bucket(time_until))
+    if cached is not None:
+        return cached
+    return lookup_known_activity(embedding, time_until)
+
+
+def stream_recommendations(activity, time_until):
+    """
+    Ask the model for one (activity, time_until) pair, streaming the
+    sections to the page as they arrive. The result is stored in the disk
+    and semantic caches on the event loop, even if this script run is
+    stopped before it finishes.
+    """
+    # Picker activities are found through the disk cache alone. Others are
+    # embedded here: it is cached by lookup_recommendations(), so costs no
+    # extra call, and the loop thread can't embed without blocking itself
+    embedding = None if activity in ACTIVITIES else semantic_embedding(activity)
+    updates = queue.Queue()
+    future = run_async(fetch_and_store(activity, time_until, embedding, updates.put))
+    show_live_preview(future, updates)
+    return future.result()
 
 
 # -----------------------
@@ -215,50 +688,36 @@ def filter_avoid_candidates(macro_summary, candidate_text):
 def main():
     st.title("Pre-Activity Meal Recommendations")
 
+    if WARM_CACHE_ON_STARTUP:
+        warm_cache()
+
     # Let user pick activity/time
-    activities = ["basketball", "weightlifting", "pilates", "running", "swimming", "yoga"]
-    activity = st.selectbox("Choose an activity", options=activities)
-    time_until = st.slider("Hours until activity", 0.0, 3.0, 1.0, 0.25)
+    activity = st.selectbox("Choose an activity", options=ACTIVITIES, accept_new_options=True)
+    time_until = st.slider("Hours until activity", TIME_OPTIONS[0], TIME_OPTIONS[-1], 1.0, 0.25)
+    force_refresh = st.checkbox("Force refresh", help="Ignore cached results and ask the model again.")
 
     if st.button("Get Recommendations"):
-        with st.spinner("Determining ideal macro ratio..."):
-            macro_explanation = step_one_get_macros(activity, time_until)
-        
-        # -----------------
-        # BEST FOODS
-        # -----------------
-        with st.spinner("Generating 20 candidate 'Best' items..."):
-            best_candidates_20 = generate_best_candidates(macro_explanation)
-        with st.spinner("Filtering to 10 'Best' items..."):
-            best_list_10 = filter_best_candidates(macro_explanation, best_candidates_20)
-
-        # -----------------
-        # OK FOODS
-        # -----------------
-        with st.spinner("Generating 20 candidate 'OK' items..."):
-            ok_candidates_20 = generate_ok_candidates(macro_explanation)
-        with st.spinner("Filtering to 10 'OK' items..."):
-            ok_list_10 = filter_ok_candidates(macro_explanation, ok_candidates_20, best_list_10)
-
-        # -----------------
-        # AVOID FOODS
-        # -----------------
-        with st.spinner("Generating 20 candidate 'Avoid' items..."):
-            avoid_candidates_20 = generate_avoid_candidates(macro_explanation)
-        with st.spinner("Filtering to 10 'Avoid' items..."):
-            avoid_list_10 = filter_avoid_candidates(macro_explanation, avoid_candidates_20)
-
-        st.subheader("Recommended Macronutrient Ratio")
-        st.write(macro_explanation)
-
-        st.subheader("Best Foods (10)")
-        st.markdown(best_list_10)
-
-        st.subheader("OK Foods (10)")
-        st.markdown(ok_list_10)
-
-        st.subheader("Foods to Avoid (10)")
-        st.markdown(avoid_list_10)
+        activity, time_until = normalize_inputs(activity, time_until)
+        if force_refresh:
+            lookup_recommendations.clear(activity, time_until)
+            get_disk_cache().delete(disk_cache_key(activity, time_until))
+            embedding = semantic_embedding(activity)
+            if embedding is not None:
+                get_semantic_cache().discard(embedding, time_bucket(time_until))
+
+        with st.spinner("Generating recommendations..."):
+            recommendations = lookup_recommendations(activity, time_until)
+            if recommendations is None:
+                try:
+                    recommendations = stream_recommendations(activity, time_until)
+                except (ValueError, openai.OpenAIError) as exc:
+                    # An unusable reply, or an API error that outlasted the retries
+                    st.error(str(exc))
+                    return
+                # Drop the cached miss, so the next rerun reads the stored result
+                lookup_recommendations.clear(activity, time_until)
+
+        st.markdown(format_recommendations(recommendations))
 
 if __name__ == "__main__":
     main()
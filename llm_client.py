@@ -0,0 +1,198 @@
+"""
+Shared OpenAI plumbing for the app: one async client and event loop per
+server process, concurrency limits and retries, and the disk cache the
+app stores validated results in.
+"""
+import asyncio
+import logging
+import threading
+
+import diskcache
+import httpx
+import openai
+import streamlit as st
+import tenacity
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# A small, fast model is plenty for short food lists. Set LLM_MODEL in the
+# secrets to fall back (e.g. "gpt-4o-mini"), and LLM_BASE_URL to point at
+# any OpenAI-compatible server, such as a self-hosted vLLM endpoint.
+MODEL = st.secrets.get("LLM_MODEL", "gpt-4.1-nano")
+LLM_BASE_URL = st.secrets.get("LLM_BASE_URL")
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Default cap on generated tokens per call (the recommendation call returns
+# the macro explanation plus all three lists)
+MAX_TOKENS = 900
+
+# At most this many API calls in flight across all sessions; calls that
+# fail transiently are tried up to RETRY_ATTEMPTS times in total
+LLM_CONCURRENCY = 8
+RETRY_ATTEMPTS = 6
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # includes APITimeoutError
+)
+
+# On-disk cache that survives restarts and redeploys
+DISK_CACHE_DIR = "./.llm_cache"
+DISK_CACHE_EXPIRE = 7 * 86400  # seconds
+
+
+@st.cache_resource
+def get_event_loop():
+    """
+    Start one asyncio event loop in a background thread, shared by every
+    session. The async client's connection pool is tied to the loop it was
+    first used on, so all requests must run on this same loop.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def run_async(coro):
+    """
+    Schedule a coroutine on the shared loop and return a
+    concurrent.futures.Future for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """
+    Create the OpenAI client once per server process, so every session and
+    rerun shares the same client (and its keep-alive HTTP connection pool).
+    HTTP/2 lets concurrent requests share one connection instead of each
+    paying for its own TLS handshake.
+    It is first called from the event loop thread, where there is no page
+    to draw a spinner on.
+    """
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    return AsyncOpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        base_url=LLM_BASE_URL,
+        http_client=http_client,
+        max_retries=0,  # limited() does the retrying
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_semaphore():
+    """
+    One semaphore per server process. Only ever used on the shared event
+    loop, so it is safe to create it outside that loop.
+    """
+    return asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+async def limited(request, can_retry=None):
+    """
+    Await request() (a function returning one API call's coroutine) while
+    holding a slot of the shared semaphore. Rate limits, server errors,
+    connection errors and timeouts are retried with randomized exponential
+    backoff, with the slot released while waiting, so one blip doesn't
+    fail the whole page.
+    If can_retry is given, a failed attempt is only retried while
+    can_retry() is true.
+    """
+    retry = tenacity.retry_if_exception_type(RETRYABLE_ERRORS)
+    if can_retry is not None:
+        retry = retry & tenacity.retry_if_exception(lambda exc: can_retry())
+    retrying = tenacity.AsyncRetrying(
+        retry=retry,
+        wait=tenacity.wait_random_exponential(min=1, max=30),
+        stop=tenacity.stop_after_attempt(RETRY_ATTEMPTS),
+        before_sleep=tenacity.before_sleep_log(logger, logging.WARNING),
+        reraise=True,
+    )
+    async for attempt in retrying:
+        with attempt:
+            async with get_llm_semaphore():
+                return await request()
+
+
+async def prompt_model(messages, on_delta=None, response_format=None, temperature=0.0,
+                       max_tokens=MAX_TOKENS):
+    """
+    Helper function to send a list of messages to the chat.completions API
+    and return the model's response text (unstripped; JSON parsing and
+    Markdown rendering both ignore surrounding whitespace).
+    If on_delta is given, the reply is streamed and on_delta(text) is called
+    with each new piece as it arrives.
+    response_format is passed through to the API, e.g. a JSON schema the
+    reply must follow.
+    The default temperature of 0 keeps replies deterministic, so callers
+    can cache what they build from them.
+    max_tokens caps the reply; size it to what the caller actually shows,
+    since decode time and cost grow with every generated token.
+    The raw reply is not cached here: it may be cut off or malformed, so
+    only the caller can tell whether it is worth keeping.
+    """
+    # Once part of a streamed reply has gone to on_delta, a retry would
+    # send the whole reply again after it, so only retry before that
+    streamed = False
+
+    options = {}
+    if response_format is not None:
+        options["response_format"] = response_format
+
+    async def request():
+        nonlocal streamed
+        if on_delta is None:
+            response = await get_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **options
+            )
+            return response.choices[0].message.content
+
+        stream = await get_client().chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **options
+        )
+        parts = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                streamed = True
+                on_delta(delta)
+        return "".join(parts)
+
+    return await limited(request, can_retry=lambda: not streamed)
+
+
+async def embed_texts(texts):
+    """
+    Return one embedding vector per input text.
+    """
+    response = await limited(
+        lambda: get_client().embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    )
+    return [item.embedding for item in response.data]
+
+
+@st.cache_resource(show_spinner=False)
+def get_disk_cache():
+    """
+    Open the on-disk cache once per server process. The cache warm-up may
+    call this first, from the event loop thread.
+    """
+    return diskcache.Cache(DISK_CACHE_DIR)
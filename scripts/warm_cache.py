@@ -0,0 +1,107 @@
+"""
+Pre-compute recommendations for every picker activity at every slider
+position with the OpenAI Batch API (half the price of live calls), and
+store them in the same disk cache the app reads from.
+
+Run from the repository root, so the app's .streamlit/secrets.toml and
+./.llm_cache are found:
+
+    python scripts/warm_cache.py
+"""
+import io
+import os
+import sys
+import time
+
+import orjson
+import streamlit as st
+from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+import llm_client  # noqa: E402
+
+POLL_SECONDS = 60
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_file(pairs):
+    """
+    One /v1/chat/completions request per (activity, time_until) pair,
+    matching what the app sends live, as JSONL bytes.
+    """
+    lines = []
+    for index, (activity, time_until) in enumerate(pairs):
+        lines.append(orjson.dumps({
+            "custom_id": str(index),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": llm_client.MODEL,
+                "messages": app.recommendation_messages(activity, time_until),
+                "temperature": app.RECOMMENDATION_TEMPERATURE,
+                "max_tokens": llm_client.MAX_TOKENS,
+                "response_format": app.RECOMMENDATION_FORMAT,
+            },
+        }))
+    return b"\n".join(lines)
+
+
+def main():
+    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"], base_url=llm_client.LLM_BASE_URL)
+    cache = llm_client.get_disk_cache()
+
+    # Only ask for what the cache doesn't already have
+    pairs = [
+        (activity, time_until)
+        for activity in app.ACTIVITIES
+        for time_until in app.TIME_OPTIONS
+        if app.disk_cache_key(activity, time_until) not in cache
+    ]
+    if not pairs:
+        print("Cache is already warm.")
+        return
+
+    batch_file = client.files.create(
+        file=("warm_cache.jsonl", io.BytesIO(build_batch_file(pairs))),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(pairs)} requests.")
+
+    while batch.status not in FINAL_STATUSES:
+        time.sleep(POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status}")
+
+    if batch.output_file_id is None:
+        sys.exit(f"Batch {batch.id} finished as {batch.status!r} with no output.")
+
+    stored = 0
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        result = orjson.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        activity, time_until = pairs[int(result["custom_id"])]
+        reply = response["body"]["choices"][0]["message"]["content"]
+        try:
+            recommendations = app.parse_recommendation(reply)
+        except ValueError:
+            continue
+        cache.set(
+            app.disk_cache_key(activity, time_until),
+            recommendations,
+            expire=llm_client.DISK_CACHE_EXPIRE,
+        )
+        stored += 1
+
+    print(f"Stored {stored} of {len(pairs)} recommendations.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+from streamlit import config
+
+# Import app.py from the repository root, as scripts/warm_cache.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# llm_client reads st.secrets at import time; give it a placeholder key
+# so the tests never need a real .streamlit/secrets.toml
+_SECRETS_DIR = tempfile.mkdtemp()
+_SECRETS_PATH = os.path.join(_SECRETS_DIR, "secrets.toml")
+with open(_SECRETS_PATH, "w") as secrets_file:
+    secrets_file.write('OPENAI_API_KEY = "test"\n')
+config.set_option("secrets.files", [_SECRETS_PATH])
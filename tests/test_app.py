@@ -0,0 +1,219 @@
+import orjson
+import pytest
+
+import app
+from app import (
+    N_ITEMS,
+    IncrementalJsonParser,
+    SemanticCache,
+    _extract_json,
+    clean_item,
+    disk_cache_key,
+    lookup_known_activity,
+    normalize_inputs,
+    parse_recommendation,
+    time_bucket,
+)
+
+REPLY = {
+    "macro_explanation": 'Mostly carbs: "quick" energy.\nKeep fats low.',
+    "best_foods": ["Banana (Carbs: 90%)", "Pretzels"],
+    "ok_foods": ["Bagel"],
+    "foods_to_avoid": ["Fries"],
+}
+REPLY_TEXT = orjson.dumps(REPLY).decode()
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalJsonParser()
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return parser, events
+
+
+# -----------------------
+# IncrementalJsonParser
+# -----------------------
+def test_parser_emits_every_leaf_with_its_path():
+    _, events = feed_in_chunks(REPLY_TEXT, len(REPLY_TEXT))
+    assert events == [
+        (("macro_explanation",), REPLY["macro_explanation"]),
+        (("best_foods", 0), "Banana (Carbs: 90%)"),
+        (("best_foods", 1), "Pretzels"),
+        (("ok_foods", 0), "Bagel"),
+        (("foods_to_avoid", 0), "Fries"),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_parser_gives_same_events_for_any_chunking(size):
+    _, whole = feed_in_chunks(REPLY_TEXT, len(REPLY_TEXT))
+    _, chunked = feed_in_chunks(REPLY_TEXT, size)
+    assert chunked == whole
+
+
+def test_parser_decodes_escapes_split_across_chunks():
+    text = r'{"a": "x\"y\\zé\n"}'
+    for size in range(1, len(text)):
+        _, events = feed_in_chunks(text, size)
+        assert events == [(("a",), 'x"y\\zé\n')]
+
+
+def test_parser_handles_nested_scalars():
+    text = '{"n": 1.5, "flags": [true, false, null], "inner": {"k": -2}, "s": "v"}'
+    _, events = feed_in_chunks(text, 1)
+    assert events == [
+        (("n",), 1.5),
+        (("flags", 0), True),
+        (("flags", 1), False),
+        (("flags", 2), None),
+        (("inner", "k"), -2),
+        (("s",), "v"),
+    ]
+
+
+def test_parser_ignores_fences_and_prose():
+    text = "Sure!\n```json\n" + REPLY_TEXT + "\n```\nEnjoy {not json}"
+    _, events = feed_in_chunks(text, 5)
+    _, expected = feed_in_chunks(REPLY_TEXT, 5)
+    assert events == expected
+
+
+@pytest.mark.parametrize("prefix", [
+    "Here are your [3] lists: ```json",
+    "Use the {activity} format: ",
+    'Notes {"draft"} then ',
+])
+def test_parser_restarts_after_brackets_and_braces_in_prose(prefix):
+    _, events = feed_in_chunks(prefix + REPLY_TEXT + "```", 3)
+    _, expected = feed_in_chunks(REPLY_TEXT, 3)
+    assert events == expected
+
+
+def test_parser_only_emits_completed_values_of_truncated_input():
+    text = '{"best_foods": ["Banana", "Pretz'
+    parser, events = feed_in_chunks(text, 4)
+    assert events == [(("best_foods", 0), "Banana")]
+    assert parser.pending_string() == (("best_foods", 1), "Pretz")
+
+
+def test_pending_string_drops_a_cut_off_escape():
+    parser = IncrementalJsonParser()
+    parser.feed(r'{"macro_explanation": "Carbs \u00')
+    assert parser.pending_string() == (("macro_explanation",), "Carbs ")
+
+
+def test_pending_string_is_none_outside_string_values():
+    parser = IncrementalJsonParser()
+    parser.feed('{"macro_expl')
+    assert parser.pending_string() is None
+    parser.feed('anation": ')
+    assert parser.pending_string() is None
+
+
+# -----------------------
+# parse_recommendation / _extract_json
+# -----------------------
+@pytest.mark.parametrize("reply", [
+    REPLY_TEXT,
+    REPLY_TEXT + "\n",
+    "```json\n" + REPLY_TEXT + "\n```",
+    "Here you go:\n" + REPLY_TEXT + "\nEnjoy!",
+    "Use {activity} format: " + REPLY_TEXT,
+    "Lists [1-3] {see below}:\n```json\n" + REPLY_TEXT + "\n``` {end}",
+])
+def test_parse_recommendation_accepts_clean_fenced_and_chatty_replies(reply):
+    assert parse_recommendation(reply) == REPLY
+
+
+def test_parse_recommendation_trims_lists_and_strips_bullets():
+    reply = dict(REPLY, best_foods=[f"- Item {i}" for i in range(N_ITEMS + 2)])
+    recommendations = parse_recommendation(orjson.dumps(reply).decode())
+    assert recommendations["best_foods"] == [f"Item {i}" for i in range(N_ITEMS)]
+
+
+@pytest.mark.parametrize("reply", [
+    REPLY_TEXT[:-20],
+    "No JSON here.",
+    '{"macro_explanation": "m"}',
+    orjson.dumps(dict(REPLY, ok_foods="Bagel")).decode(),
+    "[1, 2]",
+])
+def test_parse_recommendation_rejects_truncated_or_invalid_replies(reply):
+    with pytest.raises(ValueError):
+        parse_recommendation(reply)
+
+
+def test_extract_json_returns_the_first_complete_object():
+    assert _extract_json('```json\n{"a": {"b": 1}}\n```') == {"a": {"b": 1}}
+    assert _extract_json('{x} then {"a": 1} and {"b": 2}') == {"a": 1}
+    with pytest.raises(ValueError):
+        _extract_json("} backwards {")
+
+
+# -----------------------
+# Input helpers
+# -----------------------
+def test_clean_item_keeps_leading_numbers_that_are_not_bullets():
+    assert clean_item("2) Banana") == "Banana"
+    assert clean_item("• Banana") == "Banana"
+    assert clean_item("7-Eleven taquito") == "7-Eleven taquito"
+    assert clean_item("1.5 cups rice") == "1.5 cups rice"
+
+
+def test_normalize_inputs():
+    assert normalize_inputs(" Basketball ", 1.0000001) == ("basketball", 1.0)
+
+
+def test_time_bucket_pairs_neighbouring_slider_steps():
+    buckets = [time_bucket(time_until) for time_until in app.TIME_OPTIONS]
+    assert buckets == [0.0, 0.0, 0.5, 0.5, 1.0, 1.0, 1.5, 1.5, 2.0, 2.0, 2.5, 2.5, 3.0]
+
+
+# -----------------------
+# SemanticCache
+# -----------------------
+def test_semantic_cache_matches_similar_embeddings_in_the_same_bucket():
+    cache = SemanticCache(threshold=0.9)
+    cache.store([1.0, 0.0], 1.0, "basketball")
+    assert cache.lookup([0.95, 0.31], 1.0) == "basketball"
+    assert cache.lookup([0.95, 0.31], 1.5) is None
+    assert cache.lookup([0.0, 1.0], 1.0) is None
+
+
+def test_semantic_cache_discard_only_removes_matching_entries():
+    cache = SemanticCache(threshold=0.9)
+    cache.store([1.0, 0.0], 1.0, "basketball")
+    cache.store([1.0, 0.0], 2.0, "basketball later")
+    cache.store([0.0, 1.0], 1.0, "yoga")
+    cache.discard([1.0, 0.0], 1.0)
+    assert cache.lookup([1.0, 0.0], 1.0) is None
+    assert cache.lookup([1.0, 0.0], 2.0) == "basketball later"
+    assert cache.lookup([0.0, 1.0], 1.0) == "yoga"
+
+
+def test_semantic_cache_evicts_the_oldest_entries_of_a_full_bucket():
+    cache = SemanticCache(threshold=0.9, max_entries=2)
+    cache.store([1.0, 0.0], 1.0, "first")
+    cache.store([0.0, 1.0], 1.0, "second")
+    cache.store([0.0, -1.0], 1.0, "third")
+    cache.store([1.0, 0.0], 2.0, "other bucket")
+    assert cache.lookup([1.0, 0.0], 1.0) is None
+    assert cache.lookup([0.0, 1.0], 1.0) == "second"
+    assert cache.lookup([0.0, -1.0], 1.0) == "third"
+    assert cache.lookup([1.0, 0.0], 2.0) == "other bucket"
+
+
+def test_lookup_known_activity_reads_similar_picker_activities_from_disk(monkeypatch):
+    disk = {disk_cache_key("basketball", 1.25): "basketball at 1.25h"}
+    monkeypatch.setattr(app, "get_disk_cache", lambda: disk)
+    monkeypatch.setattr(app, "get_activity_embeddings", lambda: {
+        "basketball": [1.0, 0.0],
+        "yoga": [0.0, 1.0],
+    })
+    # Same bucket as 1.25h, falling back from the exact time
+    assert lookup_known_activity([0.99, 0.14], 1.0) == "basketball at 1.25h"
+    assert lookup_known_activity([0.99, 0.14], 1.5) is None
+    assert lookup_known_activity([0.0, 1.0], 1.25) is None
+    assert lookup_known_activity([0.7, 0.7], 1.25) is None
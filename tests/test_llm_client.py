@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+import tenacity
+
+import llm_client
+
+REQUEST = httpx.Request("POST", "https://api.openai.test/v1/chat/completions")
+
+
+def server_error():
+    return openai.InternalServerError(
+        "Service unavailable",
+        response=httpx.Response(503, request=REQUEST),
+        body=None,
+    )
+
+
+def connection_error():
+    return openai.APIConnectionError(request=REQUEST)
+
+
+class FakeStream:
+    """
+    Async iterator over chat completion chunks; an exception in the
+    script is raised when reached, like a connection dropping mid-stream.
+    """
+
+    def __init__(self, script):
+        self._script = list(script)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._script:
+            raise StopAsyncIteration
+        piece = self._script.pop(0)
+        if isinstance(piece, Exception):
+            raise piece
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+class FakeClient:
+    """
+    Stands in for AsyncOpenAI. Each create() call takes the next attempt:
+    an exception to raise, or the pieces of a streamed reply.
+    """
+
+    def __init__(self, *attempts):
+        self._attempts = list(attempts)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls += 1
+        attempt = self._attempts.pop(0)
+        if isinstance(attempt, Exception):
+            raise attempt
+        return FakeStream(attempt)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(*attempts):
+        client = FakeClient(*attempts)
+        monkeypatch.setattr(llm_client, "get_client", lambda: client)
+        return client
+
+    # A fresh semaphore per test loop, and no backoff sleeps
+    monkeypatch.setattr(llm_client, "get_llm_semaphore", lambda: asyncio.Semaphore(1))
+    monkeypatch.setattr(
+        llm_client.tenacity, "wait_random_exponential", lambda **kwargs: tenacity.wait_none()
+    )
+    return install
+
+
+def stream_reply(deltas):
+    return asyncio.run(llm_client.prompt_model(
+        [{"role": "user", "content": "hi"}],
+        on_delta=deltas.append,
+    ))
+
+
+def test_server_error_before_the_stream_is_retried(fake_client):
+    client = fake_client(server_error(), ["Hel", "lo"])
+    deltas = []
+    assert stream_reply(deltas) == "Hello"
+    assert client.calls == 2
+    assert deltas == ["Hel", "lo"]
+
+
+def test_connection_error_mid_stream_is_not_retried(fake_client):
+    client = fake_client(["Hel", connection_error()], ["Hello"])
+    deltas = []
+    with pytest.raises(openai.APIConnectionError):
+        stream_reply(deltas)
+    assert client.calls == 1
+    assert deltas == ["Hel"]
+
+
+def test_retried_stream_sends_no_duplicate_text(fake_client):
+    client = fake_client(connection_error(), server_error(), ["{\"a\": ", "1}"])
+    deltas = []
+    assert stream_reply(deltas) == "{\"a\": 1}"
+    assert client.calls == 3
+    assert "".join(deltas) == "{\"a\": 1}"